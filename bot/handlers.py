@@ -1,11 +1,22 @@
 """
 Обработчики команд и сообщений бота
 """
+import asyncio
 import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import threading
 import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
 import pandas as pd
-from aiogram import Router, F
+from aiogram import Dispatcher, Router, F
 from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 
@@ -17,15 +28,278 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from bot.states import DataVisualizationStates
 from bot.keyboards import get_main_keyboard, create_columns_keyboard
+from visualization.dtypes import encode_categories
 from visualization.profiler import DataProfiler
-from visualization.recommender import VisualizationRecommender
-from visualization.plots import PlotGenerator
+from visualization.plots import render_plot
+from visualization.reader import (
+    LARGE_FILE_SIZE,
+    convert_to_parquet,
+    iter_parquet_columns,
+    read_columns,
+    read_table,
+    sniff_schema,
+    stream_excel_to_parquet
+)
 
 router = Router()
 
+# Сколько памяти (по оценке профайлера) могут занимать разобранные файлы в кэше
+DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Процессы для рендера графиков: Kaleido и построение фигуры держат GIL,
+# в отдельных процессах графики разных пользователей строятся параллельно
+PLOT_WORKERS = 2
+# Поддерживаемые расширения Excel файлов
+_ALLOWED_EXTS = frozenset({".xlsx", ".xls"})
+
+
+@dataclass
+class _UserLock:
+    """Блокировка пользователя и число обработчиков, которые её держат или ждут"""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+# Блокировки по пользователю: у одного пользователя файл загружается, разбирается
+# и график строится не больше чем в одном обработчике одновременно. Запись
+# удаляется, когда блокировку больше никто не держит и не ждёт
+_user_locks: Dict[int, _UserLock] = {}
+
+
+def _user_busy(user_id: int) -> bool:
+    """Занята ли блокировка пользователя другим обработчиком"""
+    user_lock = _user_locks.get(user_id)
+    return user_lock is not None and user_lock.lock.locked()
+
+
+@asynccontextmanager
+async def _user_lock(user_id: int) -> AsyncIterator[None]:
+    """Выполнить блок под блокировкой пользователя"""
+    user_lock = _user_locks.get(user_id)
+    if user_lock is None:
+        user_lock = _user_locks[user_id] = _UserLock()
+    user_lock.users += 1
+    try:
+        async with user_lock.lock:
+            yield
+    finally:
+        user_lock.users -= 1
+        if not user_lock.users:
+            del _user_locks[user_id]
+
+
+@dataclass
+class LoadedData:
+    """Разобранный файл пользователя вместе с профилем данных"""
+    df: pd.DataFrame
+    basic_info: Dict[str, Any]
+    column_infos: Dict[str, Dict[str, Any]]
+
+
+# Ключ — путь к файлу, значение — (время изменения файла, данные).
+# Кэш используется из потоков asyncio.to_thread, поэтому доступ под блокировкой
+_data_cache: "OrderedDict[str, Tuple[float, LoadedData]]" = OrderedDict()
+_data_cache_bytes = 0
+_data_cache_lock = threading.Lock()
+
+
+def _cached_data(file_path: str) -> Optional[LoadedData]:
+    """Данные файла из кэша или None, если файла там нет или он изменился"""
+    mtime = os.path.getmtime(file_path)
+    with _data_cache_lock:
+        cached = _data_cache.get(file_path)
+        if cached is None or cached[0] != mtime:
+            return None
+        _data_cache.move_to_end(file_path)
+        return cached[1]
+
+
+def _load_data(file_path: str) -> LoadedData:
+    """
+    Загрузить файл пользователя через LRU-кэш
+    
+    Файл разбирается один раз на загрузку, повторные нажатия на карточки
+    колонок берут DataFrame и профиль из памяти. Время изменения файла
+    входит в ключ, поэтому перезаписанный файл будет прочитан заново.
+    
+    Args:
+        file_path: Абсолютный путь к файлу
+        
+    Returns:
+        LoadedData с DataFrame и базовой информацией
+    """
+    loaded = _cached_data(file_path)
+    if loaded is not None:
+        return loaded
+    
+    loaded = _profile_data(read_table(file_path))
+    _remember_data(file_path, loaded)
+    return loaded
+
+
+def _profile_data(df: pd.DataFrame) -> LoadedData:
+    """Посчитать базовую информацию и профиль всех колонок за один проход"""
+    profiler = DataProfiler(df)
+    return LoadedData(
+        df=df,
+        basic_info=profiler.get_basic_info(),
+        column_infos=profiler.profile_all()
+    )
+
+
+def _remember_data(file_path: str, loaded: LoadedData):
+    """
+    Положить данные файла в кэш, вытеснив самые старые записи
+    
+    Размер кэша ограничен суммарной памятью DataFrame (memory_usage из профиля),
+    а не числом файлов: один файл может занимать сотни мегабайт. Файл больше
+    DATA_CACHE_MAX_BYTES не кэшируется — колонки для графиков читаются с диска.
+    """
+    global _data_cache_bytes
+    mtime = os.path.getmtime(file_path)
+    size = loaded.basic_info["memory_usage"]
+    with _data_cache_lock:
+        _pop_cached(file_path)
+        if size > DATA_CACHE_MAX_BYTES:
+            return
+        _data_cache[file_path] = (mtime, loaded)
+        _data_cache_bytes += size
+        while _data_cache_bytes > DATA_CACHE_MAX_BYTES:
+            _pop_cached(next(iter(_data_cache)))
+
+
+def _pop_cached(file_path: str):
+    """Убрать запись из кэша и из учёта памяти (вызывается под _data_cache_lock)"""
+    global _data_cache_bytes
+    cached = _data_cache.pop(file_path, None)
+    if cached is not None:
+        _data_cache_bytes -= cached[1].basic_info["memory_usage"]
+
+
+def _forget_data(file_path: str):
+    """Убрать файл из кэша (после удаления или замены файла)"""
+    with _data_cache_lock:
+        _pop_cached(file_path)
+
+
+def _silent_unlink(file_path: str):
+    """Удалить файл, если он есть (одним системным вызовом, без проверки exists)"""
+    try:
+        os.unlink(file_path)
+    except OSError:
+        pass
+
+
+def _profile_by_column(parquet_path: str) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Профиль большого файла: Parquet читается по одной колонке
+    
+    Число уникальных значений оценивается HyperLogLog: для порогов выбора
+    графика (до 10/20 значений) оценка практически точная, а хэш-таблица
+    размером с колонку не строится.
+    
+    Returns:
+        Базовая информация (как DataProfiler.get_basic_info) и профиль колонок
+    """
+    column_infos = {}
+    dtypes = {}
+    memory_usage = 0
+    n_rows = 0
+    for frame in iter_parquet_columns(parquet_path):
+        column = frame.columns[0]
+        profiler = DataProfiler(frame)
+        column_infos[column] = profiler.profile_all(approximate_unique=True)[column]
+        dtypes[column] = frame.dtypes[column]
+        memory_usage += profiler.get_basic_info()["memory_usage"]
+        n_rows = len(frame)
+    columns = list(column_infos)
+    basic_info = {
+        "shape": (n_rows, len(columns)),
+        "columns": columns,
+        "dtypes": dtypes,
+        "memory_usage": memory_usage,
+        "null_counts": {col: info["null_count"] for col, info in column_infos.items()}
+    }
+    return basic_info, column_infos
+
+
+def _prepare_upload(file_path: str) -> Tuple[str, Dict[str, Any], Dict[str, Dict[str, Any]]]:
+    """
+    Разобрать загруженный Excel и по возможности сохранить его в Parquet
+    
+    Excel разбирается один раз; дальше все чтения идут из Parquet, а исходный
+    файл удаляется. Если данные нельзя записать в Parquet, остаётся Excel.
+    Большие файлы конвертируются порциями и профилируются по одной колонке,
+    целиком в память они не загружаются (и в кэш DataFrame не попадают).
+    
+    Args:
+        file_path: Путь к скачанному Excel файлу
+        
+    Returns:
+        Путь к файлу, с которым дальше работает бот, базовая информация
+        и профиль колонок
+    """
+    if os.path.getsize(file_path) > LARGE_FILE_SIZE:
+        parquet_path = stream_excel_to_parquet(file_path)
+        if parquet_path is not None:
+            _silent_unlink(file_path)
+            basic_info, column_infos = _profile_by_column(parquet_path)
+            return parquet_path, basic_info, column_infos
+    
+    df = encode_categories(read_table(file_path))
+    # Профиль всех колонок считаем сразу: данные файла больше не меняются
+    loaded = _profile_data(df)
+    parquet_path = convert_to_parquet(df, file_path)
+    if parquet_path is not None:
+        _silent_unlink(file_path)
+        file_path = parquet_path
+    _remember_data(file_path, loaded)
+    return file_path, loaded.basic_info, loaded.column_infos
+
+
+def _state_for(file_path: str, basic_info: Dict[str, Any],
+               column_infos: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Данные разобранного файла для FSM-состояния
+    
+    Значения — только JSON-совместимые встроенные типы (типы колонок строками),
+    чтобы состояние без изменений хранилось и в MemoryStorage, и в RedisStorage.
+    """
+    columns = list(basic_info["columns"])
+    dtypes = {col: str(dtype) for col, dtype in basic_info["dtypes"].items()}
+    return {
+        "file_path": file_path,
+        "columns": columns,
+        "dtypes": dtypes,
+        "column_infos": column_infos,
+        # Для кнопки анализа: показываем сохранённую сводку, не перечитывая файл
+        "basic_info": {
+            "shape": list(basic_info["shape"]),
+            "columns": columns,
+            "dtypes": dtypes,
+            "null_counts": {col: int(count) for col, count in basic_info["null_counts"].items()}
+        }
+    }
+
+
+async def _prepare_state(state: FSMContext, file_path: str) -> Dict[str, Any]:
+    """
+    Разобрать файл, для которого при загрузке была прочитана только схема
+    
+    Args:
+        state: FSM-контекст пользователя
+        file_path: Путь к скачанному Excel файлу
+        
+    Returns:
+        Обновлённые данные состояния
+    """
+    prepared = await asyncio.to_thread(_prepare_upload, file_path)
+    updates = _state_for(*prepared)
+    await state.update_data(**updates)
+    return await state.get_data()
+
 
 def cleanup_temp_files(user_id: int = None, exclude_file: str = None):
-    """Очистка временных файлов"""
+    """Очистка временных файлов (Excel и сконвертированного из него Parquet)"""
     temp_dir = Path(__file__).parent.parent
     pattern = f"temp_{user_id}_*" if user_id else "temp_*"
     
@@ -36,7 +310,7 @@ def cleanup_temp_files(user_id: int = None, exclude_file: str = None):
                 continue
             # Удаляем файлы старше 1 часа
             if file.stat().st_mtime < (time.time() - 3600):
-                file.unlink()
+                _silent_unlink(str(file))
         except Exception:
             pass
 
@@ -73,29 +347,38 @@ async def handle_document(message: Message, state: FSMContext, bot):
     """Обработчик получения документа"""
     document = message.document
     
-    if not document.file_name.endswith(('.xlsx', '.xls')):
+    file_ext = Path(document.file_name or "").suffix.lower()
+    if file_ext not in _ALLOWED_EXTS:
         await message.answer("❌ Пожалуйста, отправьте Excel файл (.xlsx или .xls)")
         return
     
     await message.answer("📥 Файл получен! Анализирую структуру данных...")
     
+    # Ждём, пока закончится построение графика по прошлому файлу: иначе его
+    # отложенный разбор запишет в состояние старый файл поверх нового
+    async with _user_lock(message.from_user.id):
+        await _receive_document(message, state, bot)
+
+
+async def _receive_document(message: Message, state: FSMContext, bot):
+    """Скачать документ, разобрать его и предложить выбрать колонку"""
+    document = message.document
+    file_ext = Path(document.file_name or "").suffix.lower()
+    
     try:
         # Очищаем старые временные файлы пользователя перед загрузкой нового
         data = await state.get_data()
         old_file_path = data.get("file_path")
-        if old_file_path and os.path.exists(old_file_path):
-            try:
-                os.remove(old_file_path)
-            except:
-                pass
+        if old_file_path:
+            _forget_data(old_file_path)
+            _silent_unlink(old_file_path)
         
-        # Очищаем старые файлы, но не текущий (он будет установлен позже)
-        cleanup_temp_files(message.from_user.id)
+        # Очищаем старые файлы, но не текущий (он будет установлен позже).
+        # glob/stat/unlink блокируют, поэтому выполняем их в отдельном потоке
+        await asyncio.to_thread(cleanup_temp_files, message.from_user.id)
         
         # Скачиваем файл
         file_info = await bot.get_file(document.file_id)
-        # Определяем расширение файла
-        file_ext = '.xlsx' if document.file_name.endswith('.xlsx') else '.xls'
         # Используем абсолютный путь для временных файлов
         temp_dir = Path(__file__).parent.parent
         file_name = f"temp_{message.from_user.id}_{document.file_id}{file_ext}"
@@ -111,30 +394,40 @@ async def handle_document(message: Message, state: FSMContext, bot):
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"Файл не был скачан. Путь: {file_path}")
         
-        # Читаем Excel файл
-        df = pd.read_excel(file_path)
-        
-        # Анализируем структуру данных
-        profiler = DataProfiler(df)
-        basic_info = profiler.get_basic_info()
-        
-        # Сохраняем данные в состояние (DataFrame не сохраняем, только путь к файлу)
-        await state.update_data(
-            file_path=file_path,
-            columns=basic_info["columns"],
-            dtypes=basic_info["dtypes"]
-        )
+        # Для клавиатуры нужна только схема: читаем заголовок и несколько строк,
+        # а полный разбор откладываем до первого выбора колонки
+        schema = await asyncio.to_thread(sniff_schema, file_path)
+        if schema is not None:
+            columns, dtypes = schema["columns"], schema["dtypes"]
+            n_rows = schema["n_rows"]
+            # Сохраняем данные в состояние (профиль появится после разбора файла)
+            await state.update_data(
+                file_path=file_path,
+                columns=columns,
+                dtypes=dtypes,
+                column_infos=None,
+                basic_info=None,
+                plot_cache={}
+            )
+        else:
+            # Читаем Excel файл, анализируем структуру данных и сохраняем в Parquet.
+            # Разбор файла блокирующий, поэтому выполняется в отдельном потоке
+            file_path, basic_info, column_infos = await asyncio.to_thread(_prepare_upload, file_path)
+            columns, dtypes = basic_info["columns"], basic_info["dtypes"]
+            n_rows = basic_info["shape"][0]
+            # Сохраняем данные в состояние (DataFrame не сохраняем, только путь к файлу)
+            await state.update_data(**_state_for(file_path, basic_info, column_infos), plot_cache={})
         
         # Формируем сообщение с информацией о файле
         info_text = (
             f"✅ Файл успешно обработан!\n\n"
-            f"📊 Размер данных: {basic_info['shape'][0]} строк × {basic_info['shape'][1]} колонок\n"
-            f"📋 Найдено колонок: {len(basic_info['columns'])}\n\n"
+            f"📊 Размер данных: {n_rows} строк × {len(columns)} колонок\n"
+            f"📋 Найдено колонок: {len(columns)}\n\n"
             f"Выберите колонку для визуализации:"
         )
         
         # Создаем клавиатуру с колонками в виде карточек
-        keyboard = create_columns_keyboard(basic_info["columns"], basic_info["dtypes"])
+        keyboard = create_columns_keyboard(columns, dtypes)
         
         await message.answer(info_text, reply_markup=keyboard)
         await state.set_state(DataVisualizationStates.choosing_column)
@@ -142,11 +435,9 @@ async def handle_document(message: Message, state: FSMContext, bot):
     except Exception as e:
         await message.answer(f"❌ Ошибка при обработке файла: {str(e)}")
         # Удаляем файл только при ошибке
-        if 'file_path' in locals() and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
+        if 'file_path' in locals():
+            _forget_data(file_path)
+            _silent_unlink(file_path)
         await state.clear()
 
 
@@ -155,22 +446,94 @@ async def handle_cancel(callback: CallbackQuery, state: FSMContext):
     """Обработчик отмены"""
     await callback.answer("Отменено")
     
+    async with _user_lock(callback.from_user.id):
+        await _cancel_upload(callback, state)
+
+
+async def _cancel_upload(callback: CallbackQuery, state: FSMContext):
+    """Удалить файл пользователя и сбросить состояние"""
     # Очищаем временный файл при отмене
     data = await state.get_data()
     file_path = data.get("file_path")
-    if file_path and os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-        except:
-            pass
+    if file_path:
+        _forget_data(file_path)
+        _silent_unlink(file_path)
     
     await state.clear()
     await callback.message.edit_text("Операция отменена. Отправьте новый Excel файл для анализа.")
 
 
 @router.callback_query(F.data.startswith("column_"), DataVisualizationStates.choosing_column)
-async def handle_column_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_column_selection(callback: CallbackQuery, state: FSMContext,
+                                  dispatcher: Optional[Dispatcher] = None):
     """Обработчик выбора колонки"""
+    # Нажатия, пока предыдущий график пользователя ещё строится, не запускают
+    # второй разбор файла и рендер
+    if _user_busy(callback.from_user.id):
+        await callback.answer("⏳ Визуализация уже создаётся, подождите...")
+        return
+    async with _user_lock(callback.from_user.id):
+        await _visualize_column(callback, state, dispatcher)
+
+
+def create_plot_executor() -> ProcessPoolExecutor:
+    """Пул процессов для рендера графиков"""
+    return ProcessPoolExecutor(max_workers=PLOT_WORKERS)
+
+
+def _replace_plot_executor(dispatcher: Dispatcher, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """
+    Заменить сломанный пул рендера в диспетчере новым
+    
+    Если пул уже заменил другой обработчик, возвращается его пул.
+    """
+    plot_executor = dispatcher["plot_executor"]
+    if plot_executor is broken:
+        broken.shutdown(wait=False, cancel_futures=True)
+        plot_executor = dispatcher["plot_executor"] = create_plot_executor()
+    return plot_executor
+
+
+async def _render(dispatcher: Optional[Dispatcher], df: pd.DataFrame, method: str, *args, **kwargs) -> bytes:
+    """
+    Построить график вне цикла событий
+    
+    Если процесс пула упал (например, его убил OOM), пул больше не принимает
+    задачи: он заменяется новым, и график строится в нём ещё раз.
+    
+    Args:
+        dispatcher: Диспетчер с пулом процессов для рендера (plot_executor);
+            если пула нет — рендер выполняется в стандартном пуле потоков
+        df: Данные для графика (в процесс передаются только они)
+        method: Название метода PlotGenerator
+        
+    Returns:
+        PNG изображение графика
+    """
+    plot_executor = dispatcher.get("plot_executor") if dispatcher is not None else None
+    job = partial(render_plot, df, method, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(plot_executor, job)
+    except BrokenProcessPool:
+        if plot_executor is None:
+            raise
+        plot_executor = _replace_plot_executor(dispatcher, plot_executor)
+        return await loop.run_in_executor(plot_executor, job)
+
+
+async def _send_columns_prompt(message: Message, columns, dtypes):
+    """Предложить выбрать другую колонку"""
+    keyboard = create_columns_keyboard(columns, dtypes)
+    await message.answer(
+        "Выберите другую колонку для визуализации или отправьте новый файл:",
+        reply_markup=keyboard
+    )
+
+
+async def _visualize_column(callback: CallbackQuery, state: FSMContext,
+                            dispatcher: Optional[Dispatcher]):
+    """Построить и отправить график для выбранной колонки"""
     column_name = callback.data.replace("column_", "")
     
     data = await state.get_data()
@@ -186,6 +549,19 @@ async def handle_column_selection(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text(f"📊 Создаю визуализацию для колонки: {column_name}")
     
     try:
+        # График для этой колонки уже отправлялся — Telegram отдаст его по file_id
+        # без повторного чтения данных и рендера
+        cached_plot = data.get("plot_cache", {}).get(column_name)
+        if cached_plot is not None:
+            try:
+                await callback.message.answer_photo(cached_plot["file_id"], caption=cached_plot["caption"])
+            except TelegramBadRequest:
+                # file_id больше не принимается — строим график заново
+                pass
+            else:
+                await _send_columns_prompt(callback.message, columns, dtypes)
+                return
+        
         # Нормализуем путь (делаем абсолютным, если он относительный)
         if not os.path.isabs(file_path):
             temp_dir = Path(__file__).parent.parent
@@ -199,86 +575,94 @@ async def handle_column_selection(callback: CallbackQuery, state: FSMContext):
             await state.clear()
             return
         
-        # Перечитываем DataFrame из файла
-        df = pd.read_excel(file_path)
+        # При загрузке была прочитана только схема — разбираем файл сейчас
+        if data.get("column_infos") is None:
+            data = await _prepare_state(state, file_path)
+            file_path = data["file_path"]
+            dtypes = data["dtypes"]
+            columns = data["columns"]
+            if column_name not in columns:
+                raise ValueError(f"Колонка {column_name} не найдена в файле")
+        
+        # Берём DataFrame из кэша, при промахе читаем с диска только нужную колонку
+        loaded = _cached_data(file_path)
+        if loaded is not None:
+            df = loaded.df
+        else:
+            df = await asyncio.to_thread(read_columns, file_path, [column_name], dtypes)
+        
+        # Информация о колонке посчитана при разборе файла
+        column_info = data["column_infos"].get(column_name)
+        if column_info is None:
+            column_info = await asyncio.to_thread(DataProfiler(df).get_column_info, column_name)
         
         # Определяем тип данных колонки
+        series = df[column_name]
         column_dtype = str(dtypes.get(column_name, "unknown"))
-        is_numeric = pd.api.types.is_numeric_dtype(df[column_name])
-        is_datetime = pd.api.types.is_datetime64_any_dtype(df[column_name])
+        is_numeric = pd.api.types.is_numeric_dtype(series)
+        is_datetime = pd.api.types.is_datetime64_any_dtype(series)
+        # Строковые колонки с повторами при разборе файла становятся category
+        is_text = series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype)
         # Проверяем, можно ли интерпретировать как даты (для object/string колонок)
-        if not is_datetime and df[column_name].dtype == object:
+        if not is_datetime and is_text:
             try:
-                sample = pd.to_datetime(df[column_name].dropna().head(100), errors='coerce')
+                sample = pd.to_datetime(series.dropna().head(100), errors='coerce')
                 is_datetime = sample.notna().sum() >= min(10, len(sample))
             except Exception:
                 pass
-        unique_count = df[column_name].nunique()
-        is_categorical = df[column_name].dtype == 'object' or unique_count <= 10
+        # Число уникальных значений уже есть в профиле — колонку заново не сканируем
+        unique_count = column_info["unique_count"]
+        is_categorical = is_text or unique_count <= 10
         
-        # Получаем рекомендацию визуализации
-        recommender = VisualizationRecommender(df)
-        plot_generator = PlotGenerator(df)
+        # В процесс рендера передаём только выбранную колонку
+        plot_df = df[[column_name]]
+        render = partial(_render, dispatcher, plot_df)
         
         # Создаем визуализацию в зависимости от типа данных
-        plot_buffer = None
+        plot_bytes = None
         plot_type = None
         
         try:
             if is_datetime:
                 # Для дат — агрегация по периоду (день/неделя/месяц)
-                plot_buffer = plot_generator.create_date_plot(column_name)
+                plot_bytes = await render("create_date_plot", column_name)
                 plot_type = "Распределение по датам"
             elif is_numeric:
                 # Для числовых данных - гистограмма или столбчатая
                 if unique_count > 20:
-                    plot_buffer = plot_generator.create_histogram(column_name)
+                    plot_bytes = await render("create_histogram", column_name)
                     plot_type = "Гистограмма"
                 else:
-                    plot_buffer = plot_generator.create_bar_plot(column_name)
+                    plot_bytes = await render("create_bar_plot", column_name)
                     plot_type = "Столбчатая диаграмма"
             elif is_categorical:
                 # Для категориальных данных - круговая или столбчатая (топ категорий)
                 if unique_count <= 8:
-                    plot_buffer = plot_generator.create_pie_plot(column_name)
+                    plot_bytes = await render("create_pie_plot", column_name)
                     plot_type = "Круговая диаграмма"
                 else:
                     # Много категорий — показываем топ-15 для читаемости
-                    plot_buffer = plot_generator.create_bar_plot(
-                        column_name, max_categories=15
-                    )
+                    plot_bytes = await render("create_bar_plot", column_name, max_categories=15)
                     plot_type = "Столбчатая диаграмма (топ-15)"
             else:
                 # По умолчанию — столбчатая с лимитом категорий
-                plot_buffer = plot_generator.create_bar_plot(
-                    column_name, max_categories=15
-                )
+                plot_bytes = await render("create_bar_plot", column_name, max_categories=15)
                 plot_type = "Столбчатая диаграмма"
         except Exception as e:
             raise ValueError(f"Ошибка при создании графика: {str(e)}")
         
-        if plot_buffer is None:
-            raise ValueError("График не был создан")
-        
-        # Отправляем график
-        # Убеждаемся, что буфер в начале
-        plot_buffer.seek(0)
-        plot_bytes = plot_buffer.read()
-        plot_buffer.close()
-        
         # Проверяем, что данные не пустые
-        if not plot_bytes or len(plot_bytes) == 0:
+        if not plot_bytes:
             raise ValueError("График не был создан или пуст")
         
         photo = BufferedInputFile(plot_bytes, filename=f"plot_{column_name}.png")
         
-        profiler = DataProfiler(df)
-        column_info = profiler.get_column_info(column_name)
-        
+        # Для больших файлов число уникальных значений — оценка HyperLogLog
+        approx_mark = "≈" if column_info.get("unique_approximate") else ""
         caption = (
             f"📊 {plot_type}: {column_name}\n\n"
             f"📈 Тип данных: {column_info['dtype']}\n"
-            f"🔢 Уникальных значений: {column_info['unique_count']}\n"
+            f"🔢 Уникальных значений: {approx_mark}{column_info['unique_count']}\n"
             f"❌ Пропущенных значений: {column_info['null_count']}"
         )
         
@@ -291,17 +675,20 @@ async def handle_column_selection(callback: CallbackQuery, state: FSMContext):
             )
         
         # Отправляем фото через bot (получаем из callback)
-        await callback.message.answer_photo(photo, caption=caption)
+        sent = await callback.message.answer_photo(photo, caption=caption)
         
-        # Предлагаем выбрать другую колонку
-        keyboard = create_columns_keyboard(columns, dtypes)
-        await callback.message.answer(
-            "Выберите другую колонку для визуализации или отправьте новый файл:",
-            reply_markup=keyboard
-        )
+        # Запоминаем file_id: при повторном выборе колонки фото отправится
+        # с серверов Telegram. Кэш сбрасывается при загрузке нового файла
+        plot_cache = dict(data.get("plot_cache") or {})
+        plot_cache[column_name] = {"file_id": sent.photo[-1].file_id, "caption": caption}
+        await state.update_data(plot_cache=plot_cache)
+        
+        await _send_columns_prompt(callback.message, columns, dtypes)
         
     except Exception as e:
         await callback.message.answer(f"❌ Ошибка при создании визуализации: {str(e)}")
+        # Клавиатуру с колонками убрал edit_text выше — отправляем её снова
+        await _send_columns_prompt(callback.message, columns, dtypes)
     
     await callback.answer()
 
@@ -309,6 +696,13 @@ async def handle_column_selection(callback: CallbackQuery, state: FSMContext):
 @router.message(F.text == "📊 Анализ данных")
 async def cmd_analyze(message: Message, state: FSMContext):
     """Обработчик кнопки анализа данных"""
+    # Ждём, пока закончится построение графика: оно может разбирать тот же файл
+    async with _user_lock(message.from_user.id):
+        await _send_analysis(message, state)
+
+
+async def _send_analysis(message: Message, state: FSMContext):
+    """Отправить сводку по загруженному файлу"""
     data = await state.get_data()
     file_path = data.get("file_path")
     
@@ -331,10 +725,17 @@ async def cmd_analyze(message: Message, state: FSMContext):
             await state.clear()
             return
         
-        df = pd.read_excel(file_path)
-        profiler = DataProfiler(df)
-        basic_info = profiler.get_basic_info()
-    
+        # При загрузке была прочитана только схема — разбираем файл сейчас
+        if data.get("column_infos") is None:
+            data = await _prepare_state(state, file_path)
+            file_path = data["file_path"]
+        
+        # Сводка посчитана при разборе файла; перечитываем файл, только если её нет
+        basic_info = data.get("basic_info")
+        if basic_info is None:
+            loaded = await asyncio.to_thread(_load_data, file_path)
+            basic_info = loaded.basic_info
+        
         info_text = (
             f"📊 Анализ данных:\n\n"
             f"Размер: {basic_info['shape'][0]} строк × {basic_info['shape'][1]} колонок\n"
@@ -7,7 +7,23 @@ from aiogram.types import (
     InlineKeyboardMarkup, 
     InlineKeyboardButton
 )
-from typing import List, Dict
+from functools import lru_cache
+from typing import List, Dict, Tuple
+
+from pandas.api.types import pandas_dtype
+
+# Иконки по dtype.kind: числа, строки/объекты, даты, логические значения
+_ICON_BY_KIND = {
+    "i": "🔢",
+    "u": "🔢",
+    "f": "🔢",
+    "O": "📝",
+    "U": "📝",
+    "S": "📝",
+    "M": "📅",
+    "b": "✓",
+}
+_DEFAULT_ICON = "📊"
 
 
 def get_main_keyboard() -> ReplyKeyboardMarkup:
@@ -22,10 +38,22 @@ def get_main_keyboard() -> ReplyKeyboardMarkup:
     return keyboard
 
 
+def _get_column_icon(dtype: str) -> str:
+    """Иконка для типа данных колонки (по dtype.kind, один поиск в словаре)"""
+    try:
+        kind = pandas_dtype(dtype).kind
+    except TypeError:
+        return _DEFAULT_ICON
+    return _ICON_BY_KIND.get(kind, _DEFAULT_ICON)
+
+
 def create_columns_keyboard(columns: List[str], dtypes: Dict[str, str]) -> InlineKeyboardMarkup:
     """
     Создать inline клавиатуру с колонками в виде карточек
     
+    Клавиатура зависит только от колонок и их типов, поэтому для одного файла
+    она строится один раз и дальше берётся из кэша.
+    
     Args:
         columns: Список названий колонок
         dtypes: Словарь с типами данных колонок
@@ -33,38 +61,28 @@ def create_columns_keyboard(columns: List[str], dtypes: Dict[str, str]) -> Inlin
     Returns:
         InlineKeyboardMarkup с кнопками колонок
     """
+    columns_with_dtypes = tuple((col, str(dtypes.get(col, "unknown"))) for col in columns)
+    return _build_columns_keyboard(columns_with_dtypes)
+
+
+@lru_cache(maxsize=128)
+def _build_columns_keyboard(columns_with_dtypes: Tuple[Tuple[str, str], ...]) -> InlineKeyboardMarkup:
+    """Построить клавиатуру по кортежу пар (колонка, тип)"""
     buttons = []
     
-    # Определяем иконки для разных типов данных
-    def get_column_icon(dtype: str) -> str:
-        dtype_str = str(dtype).lower()
-        if 'int' in dtype_str or 'float' in dtype_str:
-            return "🔢"
-        elif 'object' in dtype_str or 'string' in dtype_str:
-            return "📝"
-        elif 'datetime' in dtype_str or 'date' in dtype_str:
-            return "📅"
-        elif 'bool' in dtype_str:
-            return "✓"
-        else:
-            return "📊"
-    
     # Создаем кнопки по 2 в ряд
-    for i in range(0, len(columns), 2):
+    for i in range(0, len(columns_with_dtypes), 2):
         row = []
-        for j in range(2):
-            if i + j < len(columns):
-                col = columns[i + j]
-                dtype = dtypes.get(col, "unknown")
-                icon = get_column_icon(dtype)
-                # Обрезаем длинные названия колонок
-                display_name = col[:15] + "..." if len(col) > 15 else col
-                row.append(
-                    InlineKeyboardButton(
-                        text=f"{icon} {display_name}",
-                        callback_data=f"column_{col}"
-                    )
+        for col, dtype in columns_with_dtypes[i:i + 2]:
+            icon = _get_column_icon(dtype)
+            # Обрезаем длинные названия колонок
+            display_name = col[:15] + "..." if len(col) > 15 else col
+            row.append(
+                InlineKeyboardButton(
+                    text=f"{icon} {display_name}",
+                    callback_data=f"column_{col}"
                 )
+            )
         buttons.append(row)
     
     # Добавляем кнопку "Отменить" в конце
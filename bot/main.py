@@ -15,10 +15,33 @@ from dotenv import load_dotenv
 load_dotenv(project_root / ".env")
 
 from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from bot.handlers import router
-from bot.states import register_states
+try:
+    # uvloop быстрее стандартного цикла событий, но есть не на всех платформах (нет на Windows)
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from bot.handlers import PLOT_WORKERS, create_plot_executor, router
+from visualization import _kernels
+from visualization.plots import warmup
+
+
+def create_storage() -> BaseStorage:
+    """
+    Хранилище FSM-состояний
+    
+    Если задан REDIS_URL, состояния хранятся в Redis и переживают перезапуск
+    бота (и доступны нескольким процессам). Иначе — в памяти процесса.
+    """
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return MemoryStorage()
+    # redis нужен только для этого хранилища, поэтому импортируем его здесь
+    from aiogram.fsm.storage.redis import RedisStorage
+    return RedisStorage.from_url(redis_url)
 
 
 async def main():
@@ -28,15 +51,32 @@ async def main():
 
     # Инициализация бота и диспетчера
     bot = Bot(token=token)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=create_storage())
     
-    # Регистрация роутеров и состояний
+    # Регистрация роутеров (состояния FSM регистрируются автоматически)
     dp.include_router(router)
-    register_states(dp)
     
-    # Запуск бота
-    await dp.start_polling(bot)
+    # Пул создаём до запуска поллинга; обработчики берут его из диспетчера
+    # (и заменяют новым, если процесс пула упал)
+    plot_executor = create_plot_executor()
+    dp["plot_executor"] = plot_executor
+    
+    try:
+        # Ядра нужны и в этом процессе (профилирование загруженных файлов)
+        _kernels.warmup()
+        # Прогреваем Kaleido в каждом процессе пула: по задаче на процесс, пока
+        # остальные заняты, пул запускает новые процессы
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(plot_executor, warmup) for _ in range(PLOT_WORKERS)))
+        
+        # Запуск бота
+        await dp.start_polling(bot)
+    finally:
+        dp["plot_executor"].shutdown(cancel_futures=True)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -2,7 +2,6 @@
 Состояния FSM для бота
 """
 from aiogram.fsm.state import State, StatesGroup
-from aiogram import Dispatcher
 
 
 class DataVisualizationStates(StatesGroup):
@@ -12,9 +11,3 @@ class DataVisualizationStates(StatesGroup):
     choosing_column = State()
     choosing_visualization = State()
     customizing_plot = State()
-
-
-def register_states(dp: Dispatcher):
-    """Регистрация состояний в диспетчере"""
-    # Состояния регистрируются автоматически при использовании
-    pass
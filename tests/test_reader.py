@@ -0,0 +1,115 @@
+"""
+Тесты чтения загруженных файлов
+"""
+import os
+import re
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook
+
+# Добавляем корневую директорию проекта в путь
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from visualization.reader import sniff_schema, stream_excel_to_parquet
+
+
+def write_workbook(path: str, header, rows, dimension: str = None):
+    """
+    Записать .xlsx с данными, при необходимости подменив тег dimension листа
+
+    Args:
+        path: Путь к создаваемому файлу
+        header: Заголовок листа
+        rows: Строки данных
+        dimension: Размер листа, который будет записан в файл (например "A1:B50")
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    if dimension is None:
+        workbook.save(path)
+        return
+
+    source_path = path + ".src"
+    workbook.save(source_path)
+    with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(path, "w") as target:
+        for item in source.infolist():
+            data = source.read(item.filename)
+            if item.filename == "xl/worksheets/sheet1.xml":
+                data = re.sub(rb'<dimension ref="[^"]*" ?/>',
+                              b'<dimension ref="%s"/>' % dimension.encode(), data)
+            target.writestr(item, data)
+    os.unlink(source_path)
+
+
+class StreamExcelToParquetTest(unittest.TestCase):
+    """Потоковая конвертация большого .xlsx в Parquet"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "data.xlsx")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_ignores_stale_dimension(self):
+        rows = [(i, i * 2.5, f"v{i % 7}") for i in range(100)]
+        write_workbook(self.path, ["a", "b", "c"], rows, dimension="A1:B50")
+
+        parquet_path = stream_excel_to_parquet(self.path, batch_rows=20)
+
+        self.assertIsNotNone(parquet_path)
+        df = pd.read_parquet(parquet_path)
+        self.assertEqual(df.shape, (100, 3))
+        self.assertEqual(df["c"].iloc[-1], "v1")
+
+    def test_does_not_cast_numbers_to_strings(self):
+        # Колонка c пуста во всей первой порции, числа появляются дальше по листу
+        rows = [(i, i * 2.5, None if i < 50 else i + 0.5) for i in range(100)]
+        write_workbook(self.path, ["a", "b", "c"], rows)
+
+        parquet_path = stream_excel_to_parquet(self.path, batch_rows=20)
+
+        if parquet_path is not None:
+            df = pd.read_parquet(parquet_path)
+            self.assertTrue(pd.api.types.is_float_dtype(df["c"]))
+            self.assertEqual(df["c"].iloc[-1], 99.5)
+
+
+
+class SniffSchemaTest(unittest.TestCase):
+    """Чтение схемы .xlsx без разбора всего листа"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "data.xlsx")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stale_dimension_is_not_reported(self):
+        rows = [(i, i * 2.5, f"v{i % 7}") for i in range(300)]
+        for dimension in ("A1", "A1:B50", "A1:C60"):
+            with self.subTest(dimension=dimension):
+                write_workbook(self.path, ["a", "b", "c"], rows, dimension=dimension)
+                self.assertIsNone(sniff_schema(self.path))
+
+    def test_small_sheet_counts_rows_read(self):
+        rows = [(i, i * 2.5, f"v{i % 7}") for i in range(10)]
+        write_workbook(self.path, ["a", "b", "c"], rows, dimension="A1:C60")
+
+        schema = sniff_schema(self.path)
+
+        self.assertEqual(schema["columns"], ["a", "b", "c"])
+        self.assertEqual(schema["n_rows"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
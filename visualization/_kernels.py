@@ -0,0 +1,103 @@
+"""
+JIT-ядра (Numba) для проходов по большим числовым колонкам
+"""
+import numpy as np
+from numba import njit
+
+# cache=True сохраняет скомпилированный код на диск: после перезапуска бота
+# ядра не компилируются заново. fastmath не используем — он считает, что NaN
+# не бывает, а пропуски в колонках обычны
+
+
+@njit(cache=True)
+def _sorted_quantile(values, q):
+    """Квантиль отсортированного массива с линейной интерполяцией (как в pandas)"""
+    position = q * (values.size - 1)
+    lower = int(np.floor(position))
+    upper = min(lower + 1, values.size - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@njit(cache=True)
+def outlier_mask(values):
+    """
+    Маска выбросов по правилу 1.5 IQR за одну сортировку
+
+    Квартили считаются по значениям без NaN; сами NaN выбросами не считаются.
+    """
+    valid = values[~np.isnan(values)]
+    out = np.zeros(values.size, dtype=np.bool_)
+    if valid.size == 0:
+        return out
+    valid.sort()
+    q1 = _sorted_quantile(valid, 0.25)
+    q3 = _sorted_quantile(valid, 0.75)
+    iqr = q3 - q1
+    lower_bound = q1 - 1.5 * iqr
+    upper_bound = q3 + 1.5 * iqr
+    for i in range(values.size):
+        out[i] = values[i] < lower_bound or values[i] > upper_bound
+    return out
+
+
+@njit(cache=True)
+def histogram_nan(values, nbins):
+    """
+    Гистограмма из nbins равных интервалов между минимумом и максимумом
+
+    NaN пропускаются. Без parallel: параллельные += в общий массив счётчиков
+    давали бы гонки.
+
+    Returns:
+        Счётчики по интервалам, минимум и максимум (inf/-inf, если значений нет)
+    """
+    lo = np.inf
+    hi = -np.inf
+    for v in values:
+        if not np.isnan(v):
+            if v < lo:
+                lo = v
+            if v > hi:
+                hi = v
+    out = np.zeros(nbins, dtype=np.int64)
+    if lo > hi:
+        return out, lo, hi
+    inv = nbins / (hi - lo) if hi > lo else 0.0
+    for v in values:
+        if not np.isnan(v):
+            k = int((v - lo) * inv)
+            if k == nbins:
+                k -= 1
+            out[k] += 1
+    return out, lo, hi
+
+
+@njit(cache=True)
+def reservoir_indices(n, k, seed):
+    """
+    Номера k случайных строк из n (reservoir sampling, один проход, память O(k))
+
+    Возвращаются номера, а не значения: так выборка одинаково работает для
+    колонок любого типа (строки, даты), которые в ядро не передать.
+    """
+    np.random.seed(seed)
+    if n <= k:
+        return np.arange(n)
+    out = np.arange(k)
+    for i in range(k, n):
+        j = np.random.randint(0, i + 1)
+        if j < k:
+            out[j] = i
+    return out
+
+
+def warmup() -> None:
+    """
+    Загрузить все ядра заранее (из дискового кэша или скомпилировав)
+
+    Вызывается при старте, чтобы первый запрос пользователя не ждал компиляции.
+    """
+    values = np.zeros(4)
+    outlier_mask(values)
+    histogram_nan(values, 2)
+    reservoir_indices(4, 2, 0)
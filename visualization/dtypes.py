@@ -0,0 +1,28 @@
+"""
+Преобразование типов колонок DataFrame
+"""
+import pandas as pd
+
+# Строковая колонка хранится как category, если уникальных значений меньше этой доли строк
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def encode_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Перевести строковые колонки с повторяющимися значениями в category
+    
+    Такая колонка хранит коды и список уникальных значений: value_counts,
+    nunique и groupby работают по кодам, а в Parquet она пишется со словарём.
+    Колонки заменяются в самом df (передайте копию, если исходный нужен как есть).
+    
+    Args:
+        df: DataFrame с данными
+        
+    Returns:
+        Тот же DataFrame
+    """
+    limit = len(df) * CATEGORY_MAX_UNIQUE_RATIO
+    for column in df.columns[df.dtypes == object]:
+        if df[column].nunique() < limit:
+            df[column] = df[column].astype("category")
+    return df
@@ -2,21 +2,41 @@
 Создание графиков на Plotly: современный вид и поддержка больших данных
 """
 import io
-from typing import Optional, Tuple
+import os
+from typing import Dict, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
+from kaleido.scopes.plotly import PlotlyScope
+
+from visualization import _kernels
+from visualization._kernels import histogram_nan, reservoir_indices
 
 # Лимиты для больших данных (всегда агрегируем/ограничиваем)
 MAX_POINTS_LINE = 2000
 MAX_BAR_CATEGORIES = 25
 MAX_PIE_SLICES = 12
 HISTOGRAM_MAX_BINS = 60
+# Telegram уменьшает фото до 1280 px по длинной стороне: пиксели сверх этого
+# только удлиняют растеризацию и сжатие PNG
+TELEGRAM_PHOTO_MAX_SIDE = 1280
+EXPORT_MAX_SCALE = 2
+# PNG: WebP в Kaleido кодируется дольше (~0.12 с против ~0.08 с на график), а файл
+# в несколько десятков КБ Telegram всё равно пережимает в JPEG
+EXPORT_FORMAT = "png"
+
+# Шаблон задаётся один раз по умолчанию: px и go.Figure применяют его при создании
+# фигуры, а повторная установка шаблона в каждом update_layout заново проверяет
+# и копирует его целиком (десятки миллисекунд на график)
+CHART_TEMPLATE = "plotly_white"
+pio.templates.default = CHART_TEMPLATE
 
 # Единый стиль (title задаётся в _apply_layout). Увеличенные отступы, чтобы подписи не обрезались.
 CHART_LAYOUT = dict(
-    template="plotly_white",
     font=dict(family="Inter, system-ui, sans-serif", size=12),
     margin=dict(l=70, r=50, t=70, b=100),
     height=520,
@@ -46,13 +66,49 @@ COLORS_LINE = px.colors.qualitative.Set1
 # Для круговой диаграммы нужен длинный список (до MAX_PIE_SLICES)
 COLORS_PIE = list(px.colors.qualitative.Set3) + list(px.colors.qualitative.Pastel)[:4]
 
+# Собственный экземпляр Kaleido на процесс: headless Chromium запускается при первом
+# рендере и дальше переиспользуется. plotly.js берём из пакета plotly, MathJax не
+# подключаем (формулы в подписях не используются, а scope из plotly.io грузит его с CDN)
+_SCOPE = PlotlyScope(
+    plotlyjs=os.path.join(os.path.dirname(plotly.__file__), "package_data", "plotly.min.js"),
+    mathjax=None,
+)
+
+
+def _export_scale(fig: go.Figure) -> float:
+    """Масштаб экспорта: не больше EXPORT_MAX_SCALE и не крупнее, чем покажет Telegram."""
+    longest = max(fig.layout.width or CHART_LAYOUT["width"], fig.layout.height or CHART_LAYOUT["height"])
+    return min(EXPORT_MAX_SCALE, TELEGRAM_PHOTO_MAX_SIDE / longest)
+
+
+def _fig_to_image_bytes(fig: go.Figure, fmt: str = EXPORT_FORMAT) -> io.BytesIO:
+    """Рендер графика в изображение (высокое разрешение для чёткости в мессенджере)."""
+    image = _SCOPE.transform(
+        fig,
+        format=fmt,
+        width=fig.layout.width or CHART_LAYOUT["width"],
+        height=fig.layout.height or CHART_LAYOUT["height"],
+        scale=_export_scale(fig),
+    )
+    # Kaleido отдаёт готовые bytes: BytesIO оборачивает их без копирования
+    # (и getvalue() вернёт тот же объект), буфер не растёт по мере записи
+    return io.BytesIO(image)
+
+
+def warmup() -> None:
+    """Запустить Kaleido и загрузить JIT-ядра заранее, чтобы первый пользователь не ждал"""
+    _kernels.warmup()
+    _SCOPE.transform(go.Figure(), format="png", width=CHART_LAYOUT["width"], height=CHART_LAYOUT["height"])
+
+
+def _top_k_counts(counts: pd.Series, k: int) -> pd.Series:
+    """
+    Частоты k самых частых значений, по убыванию
 
-def _fig_to_png_bytes(fig: go.Figure) -> io.BytesIO:
-    """Рендер графика в PNG (высокое разрешение для чёткости в мессенджере)."""
-    buf = io.BytesIO()
-    fig.write_image(buf, format="png", scale=2, engine="kaleido")
-    buf.seek(0)
-    return buf
+    Из несортированных частот (value_counts(sort=False)) выбираются только
+    k наибольших — полной сортировки всех уникальных значений нет.
+    """
+    return counts.nlargest(k)
 
 
 def _apply_layout(fig: go.Figure, title: str) -> None:
@@ -67,6 +123,33 @@ class PlotGenerator:
 
     def __init__(self, df: pd.DataFrame):
         self.df = df
+        # Данные не меняются, поэтому разбор дат и частоты значений считаются
+        # один раз на колонку и переиспользуются следующими графиками
+        self._dt_cache: Dict[str, pd.Series] = {}
+        self._counts_cache: Dict[str, pd.Series] = {}
+
+    def _dates(self, column: str) -> pd.Series:
+        """Значения колонки, приведённые к датам (некорректные и пропуски отброшены)"""
+        ser = self._dt_cache.get(column)
+        if ser is None:
+            values = self.df[column].dropna()
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Разбираем только уникальные значения и раскладываем их по кодам
+                parsed = pd.to_datetime(values.cat.categories, errors="coerce")
+                ser = pd.Series(parsed.take(values.cat.codes.to_numpy()), index=values.index, name=column)
+            else:
+                ser = pd.to_datetime(values, errors="coerce")
+            ser = ser.dropna()
+            self._dt_cache[column] = ser
+        return ser
+
+    def _value_counts(self, column: str) -> pd.Series:
+        """Частоты значений колонки без сортировки (пропуски не учитываются)"""
+        counts = self._counts_cache.get(column)
+        if counts is None:
+            counts = self.df[column].value_counts(sort=False)
+            self._counts_cache[column] = counts
+        return counts
 
     def create_bar_plot(
         self,
@@ -84,9 +167,7 @@ class PlotGenerator:
             fig.update_traces(textposition="outside", texttemplate="%{y:.0f}", cliponaxis=False)
             categories = plot_df[x].tolist()
         else:
-            vc = self.df[x].value_counts()
-            if len(vc) > max_categories:
-                vc = vc.head(max_categories)
+            vc = _top_k_counts(self._value_counts(x), max_categories)
             plot_df = vc.reset_index()
             plot_df.columns = [x, "count"]
             fig = px.bar(plot_df, x=x, y="count", color="count", color_continuous_scale="Teal", text_auto=".0f")
@@ -107,35 +188,46 @@ class PlotGenerator:
             yaxis_title=y or "Количество",
         )
         _apply_layout(fig, title or f"Диаграмма: {x}")
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_histogram(self, column: str, bins: int = 30, title: Optional[str] = None) -> io.BytesIO:
-        """Гистограмма с автоматическим числом столбцов при больших данных."""
-        data = self.df[column].dropna()
-        if len(data) > 100_000:
-            data = data.sample(n=50_000, random_state=42)
-        bins = min(bins, HISTOGRAM_MAX_BINS, max(10, len(data) // 50))
-        fig = px.histogram(x=data, nbins=bins, color_discrete_sequence=[COLORS_BAR[0]])
-        # Подписать каждый столбик числом наблюдений (y в trace — это как раз количества)
-        fig.update_traces(
-            marker_line_width=0.5,
-            marker_line_color="white",
-            text=fig.data[0].y,
-            textposition="outside",
-            texttemplate="%{text:.0f}",
-            cliponaxis=False,
+        """Гистограмма с автоматическим числом столбцов; интервалы считаются по всем данным."""
+        bins = min(bins, HISTOGRAM_MAX_BINS, max(10, int(self.df[column].count()) // 50))
+        values = self.df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        # Счётчики считаются за один проход JIT-ядром; в Kaleido уходят только
+        # bins столбцов, а не сами значения
+        counts, lo, hi = histogram_nan(values, bins)
+        if lo > hi:
+            raise ValueError(f"В колонке {column} нет числовых значений")
+        width = (hi - lo) / bins if hi > lo else 1.0
+        centers = lo + width * (np.arange(bins) + 0.5)
+        fig = go.Figure(
+            go.Bar(
+                x=centers,
+                y=counts,
+                width=width,
+                marker_color=COLORS_BAR[0],
+                # Подписать каждый столбик числом наблюдений
+                marker_line_width=0.5,
+                marker_line_color="white",
+                text=counts,
+                textposition="outside",
+                texttemplate="%{text:.0f}",
+                cliponaxis=False,
+            )
         )
         _apply_layout(fig, title or f"Гистограмма: {column}")
         fig.update_layout(
+            bargap=0,
             showlegend=False,
             xaxis_title=column,
             yaxis_title="Количество",
         )
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_date_plot(self, column: str, title: Optional[str] = None) -> io.BytesIO:
         """Визуализация дат: агрегация по периоду, плавная линия или столбцы."""
-        ser = pd.to_datetime(self.df[column].dropna(), errors="coerce").dropna()
+        ser = self._dates(column)
         if ser.empty:
             raise ValueError(f"В колонке {column} нет корректных дат")
         days_span = (ser.max() - ser.min()).days
@@ -144,11 +236,16 @@ class PlotGenerator:
         elif days_span <= 365:
             freq = "W"
         else:
-            freq = "ME"
-        agg = ser.dt.to_period(freq).value_counts().sort_index()
-        agg.index = agg.index.to_timestamp()
-        plot_df = agg.reset_index()
-        plot_df.columns = ["date", "count"]
+            # Для периодов месяц обозначается "M" ("ME" — только для частот дат)
+            freq = "M"
+        if freq == "D":
+            # Дни считаем прямо по datetime64, без перевода в Period
+            agg = ser.dt.normalize().value_counts(sort=False).sort_index()
+        else:
+            # groupby сразу возвращает периоды по порядку — отдельная сортировка не нужна
+            agg = ser.groupby(ser.dt.to_period(freq)).size()
+            agg.index = agg.index.to_timestamp()
+        plot_df = pd.DataFrame({"date": agg.index, "count": agg.to_numpy()})
         if len(plot_df) <= 35:
             fig = px.bar(
                 plot_df, x="date", y="count", color="count",
@@ -165,14 +262,17 @@ class PlotGenerator:
             yaxis_title="Количество записей",
             showlegend=False,
         )
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_pie_plot(self, column: str, title: Optional[str] = None) -> io.BytesIO:
         """Круговая диаграмма: топ срезов, остальное в «Прочее» при большом числе категорий."""
-        vc = self.df[column].value_counts()
-        if len(vc) > MAX_PIE_SLICES:
+        counts = self._value_counts(column)
+        vc = _top_k_counts(counts, MAX_PIE_SLICES)
+        # Если топ покрывает не все значения, последний срез заменяем на «Прочее»
+        total = counts.sum()
+        if total > vc.sum():
             top = vc.head(MAX_PIE_SLICES - 1)
-            other_count = vc.iloc[MAX_PIE_SLICES - 1 :].sum()
+            other_count = total - top.sum()
             vc = pd.concat([top, pd.Series({"Прочее": other_count})])
         labels = vc.index.astype(str).tolist()
         values = vc.values.tolist()
@@ -204,7 +304,7 @@ class PlotGenerator:
             insidetextorientation="radial",
             textfont=dict(size=11),
         )
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_line_plot(self, x: str, y: str, title: Optional[str] = None) -> io.BytesIO:
         """Линейный график с прореживанием при большом числе точек."""
@@ -215,18 +315,18 @@ class PlotGenerator:
         fig.update_traces(line=dict(width=2.5))
         fig.update_layout(xaxis_title=x, yaxis_title=y)
         _apply_layout(fig, title or f"{y} по {x}")
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_scatter_plot(self, x: str, y: str, title: Optional[str] = None) -> io.BytesIO:
         """Точечная диаграмма с ограничением точек и полупрозрачностью."""
         plot_df = self.df[[x, y]].dropna()
         if len(plot_df) > MAX_POINTS_LINE:
-            plot_df = plot_df.sample(n=MAX_POINTS_LINE, random_state=42)
+            plot_df = plot_df.iloc[reservoir_indices(len(plot_df), MAX_POINTS_LINE, 42)]
         fig = px.scatter(plot_df, x=x, y=y, opacity=0.6)
         fig.update_traces(marker=dict(size=6, line=dict(width=0)))
         fig.update_layout(xaxis_title=x, yaxis_title=y)
         _apply_layout(fig, title or f"Диаграмма рассеяния: {y} vs {x}")
-        return _fig_to_png_bytes(fig)
+        return _fig_to_image_bytes(fig)
 
     def create_auto_visualization(self, column: str) -> Tuple[io.BytesIO, str]:
         """Автовыбор типа графика по типу данных."""
@@ -238,7 +338,26 @@ class PlotGenerator:
             return self.create_bar_plot(column), "Столбчатая диаграмма"
         if unique_count <= 8 and unique_count > 1:
             return self.create_pie_plot(column), "Круговая диаграмма"
-        top = self.df[column].value_counts().head(10)
-        temp_df = pd.DataFrame({column: top.index, "count": top.values})
-        gen = PlotGenerator(temp_df)
-        return gen.create_bar_plot(column, "count"), "Столбчатая диаграмма (топ-10)"
+        # create_bar_plot сам отбирает топ по уже посчитанным частотам
+        return self.create_bar_plot(column, max_categories=10), "Столбчатая диаграмма (топ-10)"
+
+
+def render_plot(df: pd.DataFrame, method: str, *args, **kwargs) -> bytes:
+    """
+    Построить график и вернуть PNG байтами
+
+    Функция модульного уровня, чтобы её можно было выполнить в пуле процессов
+    (аргументы и результат передаются между процессами через pickle).
+
+    Args:
+        df: Данные для графика
+        method: Название метода PlotGenerator (например, "create_histogram")
+
+    Returns:
+        PNG изображение графика
+    """
+    buf = getattr(PlotGenerator(df), method)(*args, **kwargs)
+    try:
+        return buf.getvalue()
+    finally:
+        buf.close()
@@ -1,9 +1,19 @@
 """
 Профилирование данных из Excel файлов
 """
+import sys
+import warnings
+
+import numpy as np
 import pandas as pd
 from typing import Dict, Any
 
+from visualization._kernels import outlier_mask
+from visualization.sketches import HyperLogLog
+
+# Сколько значений object-колонки смотрим для оценки занимаемой памяти
+MEMORY_SAMPLE_ROWS = 1000
+
 
 class DataProfiler:
     """Класс для анализа и профилирования данных"""
@@ -16,6 +26,7 @@ class DataProfiler:
             df: DataFrame с данными
         """
         self.df = df
+        self._profile = None
     
     def get_basic_info(self) -> Dict[str, Any]:
         """
@@ -24,18 +35,116 @@ class DataProfiler:
         Returns:
             Словарь с базовой информацией
         """
+        profile = self.profile_all()
         return {
             "shape": self.df.shape,
             "columns": list(self.df.columns),
             "dtypes": self.df.dtypes.to_dict(),
-            "memory_usage": self.df.memory_usage(deep=True).sum(),
-            "null_counts": self.df.isnull().sum().to_dict()
+            "memory_usage": self._estimate_memory_usage(),
+            "null_counts": {col: info["null_count"] for col, info in profile.items()}
         }
     
+    def _estimate_memory_usage(self) -> int:
+        """
+        Примерный объём данных в памяти (байт)
+        
+        Точный deep=True обходит каждый Python-объект в object-колонках; вместо
+        этого к «плоскому» размеру добавляется средний размер объектов по выборке
+        из MEMORY_SAMPLE_ROWS значений, умноженный на число строк.
+        """
+        total = int(self.df.memory_usage(deep=False).sum())
+        n_rows = len(self.df)
+        if n_rows == 0:
+            return total
+        for col, dtype in self.df.dtypes.items():
+            if dtype != object:
+                continue
+            sample = self.df[col].sample(n=min(MEMORY_SAMPLE_ROWS, n_rows), random_state=0)
+            total += int(sample.map(sys.getsizeof).mean() * n_rows)
+        return total
+    
+    def profile_all(self, approximate_unique: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Получить информацию обо всех колонках сразу
+        
+        Пропуски, уникальные значения и статистика числовых колонок считаются
+        векторно по всему DataFrame, а не отдельным проходом на каждую колонку.
+        Результат запоминается, повторный вызов ничего не пересчитывает.
+        
+        Args:
+            approximate_unique: Оценивать число уникальных значений через
+                HyperLogLog (фиксированная память) вместо точного nunique;
+                у такой оценки в информации о колонке unique_approximate=True
+        
+        Returns:
+            Словарь {колонка: информация} в формате get_column_info
+        """
+        if self._profile is not None:
+            return self._profile
+        
+        null_counts = self._null_counts()
+        if approximate_unique:
+            unique_counts = {col: self._estimate_unique(col) for col in self.df.columns}
+        else:
+            unique_counts = self.df.nunique()
+        numeric_cols = [col for col, dtype in self.df.dtypes.items() if dtype in ['int64', 'float64']]
+        stats = self.df[numeric_cols].agg(["mean", "median", "std", "min", "max"]) if numeric_cols else None
+        
+        profile = {}
+        for col, dtype in self.df.dtypes.items():
+            info = {
+                "name": col,
+                "dtype": str(dtype),
+                "null_count": int(null_counts[col]),
+                "unique_count": int(unique_counts[col])
+            }
+            if approximate_unique:
+                info["unique_approximate"] = True
+            if stats is not None and col in stats.columns:
+                info.update({stat: float(value) for stat, value in stats[col].items()})
+            profile[col] = info
+        
+        self._profile = profile
+        return profile
+    
+    def _null_counts(self) -> Dict[str, int]:
+        """
+        Число пропусков в каждой колонке
+        
+        Целые и логические NumPy-колонки пропусков не содержат и не сканируются,
+        для float достаточно np.isnan. Расширенные типы (category, Int64)
+        считают пропуски сами — по кодам или маске, без перевода в object.
+        """
+        counts = {}
+        for col in self.df.columns:
+            series = self.df[col]
+            dtype = series.dtype
+            if not isinstance(dtype, np.dtype):
+                counts[col] = int(series.isna().sum())
+            elif dtype.kind in "iub":
+                counts[col] = 0
+            elif dtype.kind == "f":
+                counts[col] = int(np.count_nonzero(np.isnan(series.to_numpy())))
+            elif dtype.kind in "mM":
+                counts[col] = int(np.count_nonzero(np.isnat(series.to_numpy())))
+            else:
+                counts[col] = int(np.count_nonzero(pd.isna(series.to_numpy())))
+        return counts
+    
+    def _estimate_unique(self, column: str) -> int:
+        """Оценка числа уникальных значений колонки через HyperLogLog"""
+        sketch = HyperLogLog()
+        sketch.update(self.df[column])
+        return sketch.count()
+    
     def get_statistics(self) -> Dict[str, Any]:
         """
         Получить статистику по числовым колонкам
         
+        Статистики те же, что у DataFrame.describe(), но считаются NumPy сразу
+        по всей матрице числовых колонок — один проход на статистику, а не на
+        каждую пару (колонка, статистика).
+        
         Returns:
             Словарь со статистикой
         """
@@ -43,7 +152,24 @@ class DataProfiler:
         if len(numeric_cols) == 0:
             return {}
         
-        return self.df[numeric_cols].describe().to_dict()
+        values = self.df[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        # Полностью пустые колонки дают NaN (как describe) и предупреждения NumPy
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            stats = {
+                "count": np.count_nonzero(~np.isnan(values), axis=0),
+                "mean": np.nanmean(values, axis=0),
+                "std": np.nanstd(values, axis=0, ddof=1),
+                "min": np.nanmin(values, axis=0),
+            }
+            for name, row in zip(("25%", "50%", "75%"), np.nanpercentile(values, [25, 50, 75], axis=0)):
+                stats[name] = row
+            stats["max"] = np.nanmax(values, axis=0)
+        
+        return {
+            col: {name: float(row[i]) for name, row in stats.items()}
+            for i, col in enumerate(numeric_cols)
+        }
     
     def detect_outliers(self, column: str) -> pd.Series:
         """
@@ -61,19 +187,16 @@ class DataProfiler:
         if self.df[column].dtype not in ['int64', 'float64']:
             raise ValueError(f"Колонка {column} не числовая")
         
-        Q1 = self.df[column].quantile(0.25)
-        Q3 = self.df[column].quantile(0.75)
-        IQR = Q3 - Q1
-        
-        lower_bound = Q1 - 1.5 * IQR
-        upper_bound = Q3 + 1.5 * IQR
-        
-        return (self.df[column] < lower_bound) | (self.df[column] > upper_bound)
+        # Оба квартиля и маска — в одном JIT-ядре, за одну сортировку
+        values = self.df[column].to_numpy(dtype=np.float64)
+        return pd.Series(outlier_mask(values), index=self.df.index, name=column)
     
     def get_column_info(self, column: str) -> Dict[str, Any]:
         """
         Получить детальную информацию о колонке
         
+        Если профиль всех колонок уже посчитан (profile_all), берётся из него.
+        
         Args:
             column: Название колонки
             
@@ -83,6 +206,9 @@ class DataProfiler:
         if column not in self.df.columns:
             raise ValueError(f"Колонка {column} не найдена")
         
+        if self._profile is not None:
+            return self._profile[column]
+        
         info = {
             "name": column,
             "dtype": str(self.df[column].dtype),
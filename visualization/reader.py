@@ -0,0 +1,351 @@
+"""
+Чтение загруженных файлов: исходный Excel и промежуточный Parquet
+"""
+import os
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+try:
+    import polars as pl
+except ImportError:  # polars необязателен: без него читаем Excel через pandas
+    pl = None
+
+PARQUET_SUFFIX = ".parquet"
+PARQUET_COMPRESSION = "zstd"
+EXCEL_ENGINE = "calamine"
+# Сколько строк после заголовка смотрим, чтобы угадать типы колонок
+SNIFF_SAMPLE_ROWS = 100
+# Файлы больше этого размера конвертируются в Parquet порциями, без загрузки в память
+LARGE_FILE_SIZE = 50 * 1024 * 1024
+STREAM_BATCH_ROWS = 10_000
+
+# Результат pd.api.types.infer_dtype -> тип, который дал бы pandas
+_INFERRED_DTYPES = {
+    "integer": "int64",
+    "floating": "float64",
+    "mixed-integer-float": "float64",
+    "decimal": "float64",
+    "boolean": "bool",
+    "datetime": "datetime64[ns]",
+    "datetime64": "datetime64[ns]",
+    "date": "datetime64[ns]",
+}
+
+
+def is_parquet(path: str) -> bool:
+    """Проверить, что файл уже сконвертирован в Parquet"""
+    return path.endswith(PARQUET_SUFFIX)
+
+
+def read_excel(path: str, **kwargs) -> pd.DataFrame:
+    """
+    Прочитать Excel потоковым парсером calamine
+
+    Если calamine не установлен или не справился с файлом (например, старым
+    .xls), файл читается движком pandas по умолчанию.
+    """
+    try:
+        return pd.read_excel(path, engine=EXCEL_ENGINE, **kwargs)
+    except (ImportError, ValueError):
+        return pd.read_excel(path, **kwargs)
+
+
+def _read_excel_polars(path: str) -> Optional[pd.DataFrame]:
+    """
+    Прочитать Excel через Polars (calamine, многопоточный разбор)
+
+    Результат переводится в обычный pandas DataFrame на NumPy-типах: профайлер
+    и обработчики сравнивают dtype с 'int64'/'float64'/object, а pyarrow-типы
+    ('int64[pyarrow]') эти проверки не проходят.
+
+    Типы колонок выводятся по всем строкам листа (infer_schema_length=None):
+    по умолчанию Polars смотрит только первые 100 строк и молча превращает
+    в null ячейки, которые не подходят под угаданный тип.
+
+    Returns:
+        DataFrame или None, если Polars недоступен или не смог прочитать файл
+    """
+    if pl is None:
+        return None
+    try:
+        return pl.read_excel(path, engine=EXCEL_ENGINE, infer_schema_length=None).to_pandas()
+    except (ImportError, pl.exceptions.PolarsError):
+        return None
+
+
+def read_table(path: str) -> pd.DataFrame:
+    """
+    Прочитать файл целиком
+
+    Args:
+        path: Путь к Excel или Parquet файлу
+
+    Returns:
+        DataFrame со всеми колонками
+    """
+    if is_parquet(path):
+        return pd.read_parquet(path, engine="pyarrow")
+    df = _read_excel_polars(path)
+    if df is not None:
+        return df
+    return read_excel(path)
+
+
+def _dtype_arg(columns: List[str], dtypes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Аргумент dtype для read_excel: только те типы, которые pandas умеет принять"""
+    result = {}
+    for column in columns:
+        dtype = dtypes.get(column)
+        if dtype is None:
+            continue
+        try:
+            result[column] = pd.api.types.pandas_dtype(dtype)
+        except TypeError:
+            continue
+    return result or None
+
+
+def read_columns(path: str, columns: List[str], dtypes: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """
+    Прочитать только указанные колонки
+
+    Args:
+        path: Путь к Excel или Parquet файлу
+        columns: Названия колонок
+        dtypes: Известные типы колонок (для Excel), необязательно
+
+    Returns:
+        DataFrame только с запрошенными колонками
+    """
+    if is_parquet(path):
+        return pd.read_parquet(path, engine="pyarrow", columns=list(columns))
+
+    dtype_arg = _dtype_arg(columns, dtypes or {})
+    if dtype_arg is not None:
+        try:
+            return read_excel(path, usecols=list(columns), dtype=dtype_arg)
+        except (TypeError, ValueError):
+            # Некоторые типы (например, даты) pandas не принимает в dtype, а
+            # известный тип может не подойти к значениям колонки в Excel
+            pass
+    return read_excel(path, usecols=list(columns))
+
+
+def convert_to_parquet(df: pd.DataFrame, excel_path: str) -> Optional[str]:
+    """
+    Сохранить разобранный Excel в Parquet рядом с исходным файлом
+
+    Args:
+        df: DataFrame, прочитанный из Excel
+        excel_path: Путь к исходному Excel файлу
+
+    Returns:
+        Путь к Parquet файлу или None, если данные нельзя записать в Parquet
+        (например, нестроковые названия колонок или смешанные типы в колонке)
+    """
+    parquet_path = excel_path + PARQUET_SUFFIX
+    try:
+        df.to_parquet(parquet_path, engine="pyarrow", compression=PARQUET_COMPRESSION)
+    except (ValueError, TypeError, NotImplementedError):
+        try:
+            os.unlink(parquet_path)
+        except OSError:
+            pass
+        return None
+    return parquet_path
+
+
+def _infer_sample_dtype(values: List[Any]) -> str:
+    """Угадать тип колонки по нескольким значениям"""
+    dtype = _INFERRED_DTYPES.get(pd.api.types.infer_dtype(values, skipna=True), "object")
+    # Целые с пропусками pandas читает как float64
+    if dtype == "int64" and any(value is None for value in values):
+        return "float64"
+    return dtype
+
+
+def _read_header(rows: Iterator[tuple]) -> List[Any]:
+    """Первая строка листа без пустых ячеек в конце"""
+    header = list(next(rows, ()))
+    while header and header[-1] is None:
+        header.pop()
+    return header
+
+
+def _is_clean_header(header: List[Any]) -> bool:
+    """Заголовки — непустые уникальные строки (pandas не станет их переименовывать)"""
+    if not header or len(set(header)) != len(header):
+        return False
+    return all(isinstance(name, str) and name for name in header)
+
+
+def sniff_schema(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Прочитать только схему .xlsx: заголовок, число строк и примерные типы
+
+    Книга открывается в режиме read_only, читаются заголовок и первые
+    SNIFF_SAMPLE_ROWS строк, поэтому время не зависит от размера листа.
+    Схема возвращается, только если её можно сопоставить с тем, что потом
+    прочитает pandas: заголовки — непустые уникальные строки, а размер листа
+    записан в файле и не противоречит прочитанным строкам (тег dimension
+    часто пишут неверным). Если лист целиком уместился в выборку, число
+    строк берётся из неё.
+
+    Args:
+        path: Путь к .xlsx файлу
+
+    Returns:
+        Словарь с ключами columns, dtypes и n_rows или None, если файл
+        нужно разбирать целиком
+    """
+    if not path.endswith(".xlsx"):
+        return None
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        # pandas по умолчанию читает первый лист
+        sheet = workbook.worksheets[0]
+        if sheet.max_row is None:
+            return None
+        # Размер листа из файла; сами строки читаем без него и сверяем с ним
+        n_rows = sheet.max_row - sheet.min_row
+        n_columns = sheet.max_column
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = _read_header(rows)
+        # Строка сверх выборки показывает, что лист на ней не кончается
+        sample = list(islice(rows, SNIFF_SAMPLE_ROWS + 1))
+    finally:
+        workbook.close()
+
+    if not _is_clean_header(header) or len(header) > n_columns:
+        return None
+
+    if len(sample) > SNIFF_SAMPLE_ROWS:
+        sample.pop()
+        if n_rows <= SNIFF_SAMPLE_ROWS:
+            return None
+    else:
+        # Лист прочитан целиком; пустые строки в конце pandas не читает
+        while sample and all(value is None for value in sample[-1]):
+            sample.pop()
+        n_rows = len(sample)
+
+    dtypes = {}
+    for i, column in enumerate(header):
+        values = [row[i] if i < len(row) else None for row in sample]
+        dtypes[column] = _infer_sample_dtype(values)
+
+    return {"columns": header, "dtypes": dtypes, "n_rows": n_rows}
+
+
+def _widen_type(arrow_type: pa.DataType) -> pa.DataType:
+    """
+    Тип колонки для всего файла по первой порции строк
+
+    Целые расширяются до float64 (в следующих порциях могут встретиться
+    пропуски). Полностью пустая колонка остаётся типа null: угадывать её тип
+    по пустой порции нельзя, поэтому значения в ней дальше по листу
+    отправляют файл на полный разбор.
+    """
+    if pa.types.is_integer(arrow_type):
+        return pa.float64()
+    return arrow_type
+
+
+def _fits(arrow_type: pa.DataType, file_type: pa.DataType) -> bool:
+    """Можно ли без потерь привести тип колонки в порции к типу файла"""
+    if arrow_type == file_type or pa.types.is_null(arrow_type):
+        return True
+    return pa.types.is_integer(arrow_type) and pa.types.is_floating(file_type)
+
+
+def _write_batch(writer: Optional[pq.ParquetWriter], parquet_path: str,
+                 rows: List[tuple], header: List[str]) -> pq.ParquetWriter:
+    """
+    Записать порцию строк, при первой порции создать writer со схемой файла
+
+    Raises:
+        ValueError: Тип колонки в порции не совпадает с типом файла (например,
+            числа после строк): приведение молча превратило бы значения в строки
+    """
+    width = len(header)
+    # Без размеров из файла openpyxl не дополняет строки пустыми ячейками до ширины листа
+    frame = pd.DataFrame([row[:width] + (None,) * (width - len(row)) for row in rows], columns=header)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if writer is None:
+        schema = pa.schema([pa.field(field.name, _widen_type(field.type)) for field in table.schema])
+        writer = pq.ParquetWriter(parquet_path, schema, compression=PARQUET_COMPRESSION)
+    for field, file_field in zip(table.schema, writer.schema):
+        if not _fits(field.type, file_field.type):
+            raise ValueError(f"Тип колонки {field.name} меняется по ходу листа")
+    writer.write_table(table.cast(writer.schema))
+    return writer
+
+
+def stream_excel_to_parquet(path: str, batch_rows: int = STREAM_BATCH_ROWS) -> Optional[str]:
+    """
+    Сконвертировать большой .xlsx в Parquet порциями по batch_rows строк
+
+    Лист читается через openpyxl в режиме read_only, в памяти одновременно
+    находится только одна порция строк. Размер листа, записанный в файле
+    (тег dimension), не используется: его часто пишут неверным, и тогда
+    часть строк и колонок молча потерялась бы.
+
+    Args:
+        path: Путь к .xlsx файлу
+        batch_rows: Сколько строк записывать за раз
+
+    Returns:
+        Путь к Parquet файлу или None, если файл нужно разбирать целиком
+        (не .xlsx, «грязный» заголовок или тип колонки меняется по ходу листа)
+    """
+    if not path.endswith(".xlsx"):
+        return None
+
+    parquet_path = path + PARQUET_SUFFIX
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    writer = None
+    try:
+        sheet = workbook.worksheets[0]
+        # Строки всё равно читаются до конца листа — размер из файла не нужен
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = _read_header(rows)
+        if not _is_clean_header(header):
+            return None
+        while True:
+            batch = list(islice(rows, batch_rows))
+            if not batch:
+                break
+            writer = _write_batch(writer, parquet_path, batch, header)
+    except (pa.ArrowException, ValueError, TypeError):
+        if writer is not None:
+            writer.close()
+            writer = None
+        try:
+            os.unlink(parquet_path)
+        except OSError:
+            pass
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+        workbook.close()
+
+    if writer is None:
+        # Лист без строк данных — нечего стримить
+        return None
+    return parquet_path
+
+
+def iter_parquet_columns(path: str) -> Iterator[pd.DataFrame]:
+    """Читать Parquet по одной колонке (в памяти всегда только одна колонка)"""
+    parquet_file = pq.ParquetFile(path)
+    for name in parquet_file.schema_arrow.names:
+        yield parquet_file.read(columns=[name]).to_pandas()
@@ -1,5 +1,52 @@
 import pandas as pd
-from typing import List, Dict, Any
+from operator import itemgetter
+from types import MappingProxyType
+from typing import List, Dict, Any, Mapping, Sequence, Tuple
+
+from visualization.dtypes import encode_categories
+
+# Порог круговой диаграммы в общих рекомендациях не больше 20: точнее число
+# уникальных значений знать не нужно
+UNIQUE_CAP = 20
+# Колонка просматривается кусками такого размера до превышения UNIQUE_CAP
+UNIQUE_SCAN_CHUNK = 65536
+
+
+# Постоянная часть рекомендаций: тип, название графика и приоритет при выборе
+# лучшей рекомендации (scatter > bar > line > pie, остальные — 0). Приоритет
+# служебный и в сами рекомендации не попадает. Шаблоны и рекомендации — только
+# для чтения: запомненные результаты отдаются всем вызывающим без копирования
+_SCATTER = MappingProxyType({"type": "scatter", "name": "Диаграмма рассеяния", "_priority": 4})
+_LINE = MappingProxyType({"type": "line", "name": "Линейный график", "_priority": 2})
+_BAR = MappingProxyType({"type": "bar", "name": "Столбчатая диаграмма", "_priority": 3})
+_BAR_TOP = MappingProxyType({"type": "bar", "name": "Столбчатая диаграмма (топ значений)", "_priority": 3})
+_PIE = MappingProxyType({"type": "pie", "name": "Круговая диаграмма", "_priority": 1})
+_HISTOGRAM = MappingProxyType({"type": "histogram", "name": "Гистограмма", "_priority": 0})
+_TABLE = MappingProxyType({"type": "table", "name": "Таблица", "_priority": 0})
+
+# Обоснования, не зависящие от данных
+_REASON_SEQUENTIAL = "Временные ряды или последовательные данные"
+_REASON_COMPARISON = "Сравнение значений по категориям"
+_REASON_FEW_VALUES = "Числовая колонка с небольшим количеством значений"
+_REASON_NO_DATA = "Недостаточно данных для визуализации"
+
+
+def _recommendation(template: Mapping[str, Any], reason: str, columns: Sequence[str]) -> Mapping[str, Any]:
+    """Рекомендация по шаблону: тип и название из шаблона, обоснование и колонки"""
+    return MappingProxyType({
+        "type": template["type"],
+        "name": template["name"],
+        "reason": reason,
+        "columns": tuple(columns),
+    })
+
+
+def _ranked(template: Mapping[str, Any], reason: str, columns: Sequence[str]) -> Tuple[int, Mapping[str, Any]]:
+    """Пара (приоритет, рекомендация) для выбора лучшей рекомендации"""
+    return template["_priority"], _recommendation(template, reason, columns)
+
+
+_by_priority = itemgetter(0)
 
 
 class VisualizationRecommender:
@@ -13,85 +60,140 @@ class VisualizationRecommender:
             df: DataFrame с данными
         """
         self.df = df
+        # Типы колонок не меняются: раскладываем их по группам один раз
+        self._dtype_map = dict(zip(df.columns, df.dtypes))
+        self._numeric_cols = []
+        self._categorical_cols = []
+        for col, dtype in self._dtype_map.items():
+            # Как select_dtypes(include=['number']): bool числом не считается
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                self._numeric_cols.append(col)
+            elif pd.api.types.is_object_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+                self._categorical_cols.append(col)
+        self._nunique_cache: Dict[str, int] = {}
+        # Точное число уникальных значений по всем колонкам: считается одним
+        # вызовом nunique() на весь DataFrame при первой рекомендации для колонки
+        self._all_nunique = None
+        # DataFrame не меняется, поэтому рекомендации считаются один раз
+        self._recs = None
+        self._ranked_recs = None
+        self._best = None
+        self._per_col_cache: Dict[str, Mapping[str, Any]] = {}
     
-    def recommend_visualizations(self) -> List[Dict[str, Any]]:
+    def _capped_nunique(self, column: str) -> int:
+        """
+        Число уникальных значений колонки (без пропусков), но не больше UNIQUE_CAP + 1
+        
+        Колонка просматривается кусками, и просмотр прекращается, как только
+        уникальных значений становится больше UNIQUE_CAP: для колонок с большим
+        числом значений обычно хватает первого куска. Результат запоминается.
+        """
+        count = self._nunique_cache.get(column)
+        if count is not None:
+            return count
+        
+        series = self.df[column]
+        seen = set()
+        count = 0
+        for start in range(0, len(series), UNIQUE_SCAN_CHUNK):
+            chunk = series.iloc[start:start + UNIQUE_SCAN_CHUNK]
+            seen.update(chunk.drop_duplicates().dropna().tolist())
+            if len(seen) > UNIQUE_CAP:
+                count = UNIQUE_CAP + 1
+                break
+        else:
+            count = len(seen)
+        self._nunique_cache[column] = count
+        return count
+    
+    def _exact_nunique(self, column: str) -> int:
+        """
+        Число уникальных значений в колонке (для всех колонок разом)
+        
+        Перед подсчётом строковые колонки с повторами переводятся в category
+        (в копии, исходный DataFrame не меняется). Это делается только здесь,
+        а не в конструкторе: общим рекомендациям точные числа не нужны.
+        """
+        if self._all_nunique is None:
+            if any(dtype == object for dtype in self._dtype_map.values()):
+                self.df = encode_categories(self.df.copy(deep=False))
+            self._all_nunique = self.df.nunique()
+        return int(self._all_nunique[column])
+    
+    def recommend_visualizations(self) -> Tuple[Mapping[str, Any], ...]:
         """
         Рекомендовать типы визуализации на основе данных
         
+        Результат запоминается: повторные вызовы возвращают тот же кортеж
+        неизменяемых рекомендаций.
+        
         Returns:
-            Список рекомендаций с типом визуализации и обоснованием
+            Кортеж рекомендаций с типом визуализации и обоснованием
         """
+        if self._recs is None:
+            self._ranked_recs = self._compute_recommendations()
+            self._recs = tuple(recommendation for _, recommendation in self._ranked_recs)
+        return self._recs
+    
+    def _compute_recommendations(self) -> List[Tuple[int, Mapping[str, Any]]]:
+        """Составить список пар (приоритет, рекомендация) по типам колонок"""
         recommendations = []
         
-        numeric_cols = self.df.select_dtypes(include=['number']).columns.tolist()
-        categorical_cols = self.df.select_dtypes(include=['object', 'category']).columns.tolist()
+        numeric_cols = self._numeric_cols
+        categorical_cols = self._categorical_cols
         
         # Рекомендации для числовых данных
         if len(numeric_cols) >= 2:
-            recommendations.append({
-                "type": "scatter",
-                "name": "Диаграмма рассеяния",
-                "reason": f"Две или более числовых колонки ({', '.join(numeric_cols[:2])})",
-                "columns": numeric_cols[:2]
-            })
+            recommendations.append(_ranked(
+                _SCATTER,
+                f"Две или более числовых колонки ({', '.join(numeric_cols[:2])})",
+                numeric_cols[:2]
+            ))
         
         if len(numeric_cols) >= 1:
-            recommendations.append({
-                "type": "line",
-                "name": "Линейный график",
-                "reason": f"Временные ряды или последовательные данные",
-                "columns": numeric_cols[:1]
-            })
-            
-            recommendations.append({
-                "type": "bar",
-                "name": "Столбчатая диаграмма",
-                "reason": f"Сравнение значений по категориям",
-                "columns": numeric_cols[:1]
-            })
+            recommendations.append(_ranked(_LINE, _REASON_SEQUENTIAL, numeric_cols[:1]))
+            recommendations.append(_ranked(_BAR, _REASON_COMPARISON, numeric_cols[:1]))
         
         # Рекомендации для категориальных данных
         if len(categorical_cols) >= 1 and len(numeric_cols) >= 1:
-            recommendations.append({
-                "type": "bar",
-                "name": "Столбчатая диаграмма",
-                "reason": f"Группировка по категориям ({categorical_cols[0]})",
-                "columns": [categorical_cols[0], numeric_cols[0]]
-            })
+            recommendations.append(_ranked(
+                _BAR,
+                f"Группировка по категориям ({categorical_cols[0]})",
+                [categorical_cols[0], numeric_cols[0]]
+            ))
         
         if len(categorical_cols) >= 1:
-            value_counts = self.df[categorical_cols[0]].value_counts()
-            if len(value_counts) <= 10:
-                recommendations.append({
-                    "type": "pie",
-                    "name": "Круговая диаграмма",
-                    "reason": f"Распределение по категориям ({categorical_cols[0]})",
-                    "columns": [categorical_cols[0]]
-                })
+            # Нужна только мощность, и только до порога
+            if self._capped_nunique(categorical_cols[0]) <= 10:
+                recommendations.append(_ranked(
+                    _PIE,
+                    f"Распределение по категориям ({categorical_cols[0]})",
+                    [categorical_cols[0]]
+                ))
         
         return recommendations
     
-    def get_best_visualization(self) -> Dict[str, Any]:
+    def get_best_visualization(self) -> Mapping[str, Any]:
         """
         Получить лучшую рекомендацию визуализации
         
         Returns:
             Словарь с лучшей рекомендацией
         """
-        recommendations = self.recommend_visualizations()
-        if not recommendations:
-            return {
-                "type": "table",
-                "name": "Таблица",
-                "reason": "Недостаточно данных для визуализации",
-                "columns": []
-            }
-        
-        # Приоритет: scatter > bar > line > pie
-        priority = {"scatter": 4, "bar": 3, "line": 2, "pie": 1}
-        return max(recommendations, key=lambda x: priority.get(x["type"], 0))
+        if self._best is None:
+            self._best = self._choose_best()
+        return self._best
     
-    def get_visualization_for_column(self, column: str) -> Dict[str, Any]:
+    def _choose_best(self) -> Mapping[str, Any]:
+        """Выбрать рекомендацию с наибольшим приоритетом"""
+        self.recommend_visualizations()
+        if not self._ranked_recs:
+            return _recommendation(_TABLE, _REASON_NO_DATA, [])
+        
+        # max возвращает первую пару с наибольшим приоритетом
+        return max(self._ranked_recs, key=_by_priority)[1]
+    
+    def get_visualization_for_column(self, column: str) -> Mapping[str, Any]:
         """
         Получить рекомендацию визуализации для конкретной колонки
         
@@ -101,57 +203,40 @@ class VisualizationRecommender:
         Returns:
             Словарь с рекомендацией визуализации
         """
+        cached = self._per_col_cache.get(column)
+        if cached is not None:
+            return cached
         if column not in self.df.columns:
             raise ValueError(f"Колонка {column} не найдена")
         
-        is_numeric = pd.api.types.is_numeric_dtype(self.df[column])
-        unique_count = self.df[column].nunique()
-        null_count = self.df[column].isnull().sum()
-        total_count = len(self.df[column])
+        recommendation = self._recommend_for_column(column)
+        self._per_col_cache[column] = recommendation
+        return recommendation
+    
+    def _recommend_for_column(self, column: str) -> Mapping[str, Any]:
+        """Рекомендация для колонки по её типу и числу уникальных значений"""
+        is_numeric = pd.api.types.is_numeric_dtype(self._dtype_map[column])
+        unique_count = self._exact_nunique(column)
         
         if is_numeric:
             # Для числовых данных
             if unique_count > 20:
-                return {
-                    "type": "histogram",
-                    "name": "Гистограмма",
-                    "reason": f"Числовая колонка с {unique_count} уникальными значениями",
-                    "columns": [column]
-                }
+                return _recommendation(
+                    _HISTOGRAM, f"Числовая колонка с {unique_count} уникальными значениями", [column]
+                )
             elif unique_count > 5:
-                return {
-                    "type": "bar",
-                    "name": "Столбчатая диаграмма",
-                    "reason": f"Числовая колонка с {unique_count} категориями",
-                    "columns": [column]
-                }
+                return _recommendation(_BAR, f"Числовая колонка с {unique_count} категориями", [column])
             else:
-                return {
-                    "type": "bar",
-                    "name": "Столбчатая диаграмма",
-                    "reason": f"Числовая колонка с небольшим количеством значений",
-                    "columns": [column]
-                }
+                return _recommendation(_BAR, _REASON_FEW_VALUES, [column])
         else:
             # Для категориальных данных
             if unique_count <= 8 and unique_count > 1:
-                return {
-                    "type": "pie",
-                    "name": "Круговая диаграмма",
-                    "reason": f"Категориальная колонка с {unique_count} категориями",
-                    "columns": [column]
-                }
+                return _recommendation(_PIE, f"Категориальная колонка с {unique_count} категориями", [column])
             elif unique_count <= 15:
-                return {
-                    "type": "bar",
-                    "name": "Столбчатая диаграмма",
-                    "reason": f"Категориальная колонка с {unique_count} категориями",
-                    "columns": [column]
-                }
+                return _recommendation(_BAR, f"Категориальная колонка с {unique_count} категориями", [column])
             else:
-                return {
-                    "type": "bar",
-                    "name": "Столбчатая диаграмма (топ значений)",
-                    "reason": f"Категориальная колонка с большим количеством категорий ({unique_count})",
-                    "columns": [column]
-                }
+                return _recommendation(
+                    _BAR_TOP,
+                    f"Категориальная колонка с большим количеством категорий ({unique_count})",
+                    [column]
+                )
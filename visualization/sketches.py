@@ -0,0 +1,60 @@
+"""
+Потоковые скетчи для приблизительной статистики по большим колонкам
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class HyperLogLog:
+    """Оценка числа уникальных значений в фиксированной памяти (HyperLogLog)"""
+
+    def __init__(self, precision: int = 14):
+        """
+        Инициализация скетча
+
+        Args:
+            precision: Число бит индекса регистра. Регистров 2**precision,
+                относительная погрешность около 1.04 / sqrt(2**precision)
+                (для 14 — примерно 0.8%)
+        """
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values: pd.Series) -> None:
+        """
+        Добавить значения в скетч (пропуски не учитываются)
+
+        Args:
+            values: Series с очередной порцией значений
+        """
+        values = values.dropna()
+        if values.empty:
+            return
+
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+        p = np.uint64(self.precision)
+        index = (hashes >> (np.uint64(64) - p)).astype(np.intp)
+        # Оставшиеся биты хэша плюс сторожевой бит, чтобы ранг был ограничен
+        rest = (hashes << p) | (np.uint64(1) << (p - np.uint64(1)))
+        # Ранг = число ведущих нулей + 1; длину в битах даёт экспонента frexp
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (65 - bit_length).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self) -> int:
+        """
+        Получить оценку числа уникальных значений
+
+        Returns:
+            Оценка кардинальности (для малых значений — линейный подсчёт,
+            практически точный)
+        """
+        m = self.registers.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))